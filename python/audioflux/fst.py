@@ -1,9 +1,12 @@
+import os
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from ctypes import Structure, POINTER, pointer, c_int, c_void_p
 from audioflux.base import Base
-from audioflux.utils import check_audio, check_audio_length, format_channel, revoke_channel
+from audioflux.utils import (ascontiguous_float32, check_audio, check_audio_length, check_out_arr, format_channel,
+                             revoke_channel)
 
 __all__ = ['FST']
 
@@ -16,6 +19,10 @@ class FST(Base):
     """
     Fast S-Transform (ST)
 
+    .. Note:: An object reuses its own work buffers on every call, so it must not be used
+              from several threads at once. Use one object per thread, or `fst_batch` with
+              ``num_workers > 1``, which runs a separate object in each worker thread.
+
     Parameters
     ----------
     radix2_exp: int
@@ -101,12 +108,58 @@ class FST(Base):
         self.fft_length = fft_length
         self.num = self.max_index - self.min_index + 1
 
+        ratio = self.samplate / self.fft_length
+        self._fre_band_arr = np.linspace(self.min_index * ratio, self.max_index * ratio, self.num, dtype=np.float32)
+        self._fre_band_arr.setflags(write=False)
+        self._x_coords = np.linspace(0, self.fft_length / self.samplate, self.fft_length + 1, dtype=np.float32)
+        self._x_coords.setflags(write=False)
+        self._y_coords = np.empty(self.num + 1, dtype=np.float32)
+        self._y_coords[0] = self._fre_band_arr[0]
+        self._y_coords[1:] = self._fre_band_arr
+        self._y_coords.setflags(write=False)
+
+        self._free_fn = self._lib['fstObj_free']
+        self._free_fn.argtypes = [POINTER(OpaqueFST)]
+        self._free_fn.restype = c_void_p
+
         fn = self._lib['fstObj_new']
         fn.argtypes = [POINTER(POINTER(OpaqueFST)), c_int]
         fn(self._obj,
            c_int(self.radix2_exp))
         self._is_created = True
 
+        self._fst_fn = self._lib['fstObj_fst']
+        self._fst_fn.argtypes = [POINTER(OpaqueFST),
+                                 np.ctypeslib.ndpointer(dtype=np.float32, ndim=1, flags='C_CONTIGUOUS'),
+                                 c_int,
+                                 c_int,
+                                 np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags='C_CONTIGUOUS'),
+                                 np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags='C_CONTIGUOUS'),
+                                 ]
+
+        # fstObj_fstComplex writes an interleaved complex64 matrix directly,
+        # libraries built before it was added only have fstObj_fst
+        try:
+            self._fst_complex_fn = self._lib['fstObj_fstComplex']
+        except AttributeError:
+            self._fst_complex_fn = None
+        else:
+            self._fst_complex_fn.argtypes = [POINTER(OpaqueFST),
+                                             np.ctypeslib.ndpointer(dtype=np.float32, ndim=1, flags='C_CONTIGUOUS'),
+                                             c_int,
+                                             c_int,
+                                             np.ctypeslib.ndpointer(dtype=np.complex64, ndim=2, flags='C_CONTIGUOUS'),
+                                             ]
+
+        # Per-object buffers fstObj_fst writes into; results are always copied out
+        # of them, so an object must not be used from several threads at once.
+        # Allocated on first use, fst/fst_batch don't need them when
+        # fstObj_fstComplex is available.
+        self._m_real_arr = None
+        self._m_imag_arr = None
+
+        self._fst_complex = self._new_fst_complex()
+
     def get_fre_band_arr(self):
         """
         Get an array of FST frequency bands of different scales.
@@ -114,11 +167,43 @@ class FST(Base):
         Returns
         -------
         out: np.ndarray [shape=(fre,)]
+            Cached on the object, read-only.
         """
 
-        return np.arange(self.min_index, self.max_index + 1, dtype=np.float32) * self.samplate / self.fft_length
+        return self._fre_band_arr
+
+    def _get_buffer_arr(self):
+        if self._m_real_arr is None:
+            self._m_real_arr = np.empty((self.num, self.fft_length), dtype=np.float32)
+            self._m_imag_arr = np.empty((self.num, self.fft_length), dtype=np.float32)
+        return self._m_real_arr, self._m_imag_arr
+
+    def _fst(self, data_arr, m_real_arr=None, m_imag_arr=None):
+        if m_real_arr is None:
+            m_real_arr, m_imag_arr = self._get_buffer_arr()
+        self._fst_fn(self._obj, data_arr, c_int(self.min_index), c_int(self.max_index), m_real_arr, m_imag_arr)
+        return m_real_arr, m_imag_arr
+
+    def _new_fst_complex(self):
+        # Bind everything that is fixed for the object's lifetime, so the per-row
+        # call does no attribute lookups or ctypes argument construction.
+        obj = self._obj
+        min_index, max_index = c_int(self.min_index), c_int(self.max_index)
+        fst_complex_fn = self._fst_complex_fn
+        if fst_complex_fn is not None:
+            def _fst_complex(data_arr, m_ret_arr):
+                fst_complex_fn(obj, data_arr, min_index, max_index, m_ret_arr)
+        else:
+            fst_fn = self._fst_fn
+            m_real_arr, m_imag_arr = self._get_buffer_arr()
+
+            def _fst_complex(data_arr, m_ret_arr):
+                fst_fn(obj, data_arr, min_index, max_index, m_real_arr, m_imag_arr)
+                m_ret_arr.real = m_real_arr
+                m_ret_arr.imag = m_imag_arr
+        return _fst_complex
 
-    def fst(self, data_arr):
+    def fst(self, data_arr, out=None):
         """
         Get spectrogram data
 
@@ -127,42 +212,167 @@ class FST(Base):
         data_arr: np.ndarray [shape=(..., 2**radix2_exp)]
             Input audio data
 
+        out: None or np.ndarray [shape=(..., fre, time), dtype=np.complex64]
+            If given, the result is written into this C-contiguous array and returned.
+
         Returns
         -------
-        out: np.ndarray [shape=(..., fre, time), dtype=np.complex]
+        out: np.ndarray [shape=(..., fre, time), dtype=np.complex64]
+        """
+        data_arr = ascontiguous_float32(data_arr)
+        check_audio(data_arr, is_mono=False)
+        if data_arr.shape[-1] != self.fft_length:
+            data_arr = check_audio_length(data_arr, self.radix2_exp)
+
+        shape = (*data_arr.shape[:-1], self.num, self.fft_length)
+        if out is None:
+            out = np.empty(shape, dtype=np.complex64)
+        else:
+            check_out_arr(out, shape, np.complex64)
+
+        if data_arr.ndim == 1:
+            self._fst_complex(data_arr, out)
+        else:
+            data_arr, _ = format_channel(data_arr, 1)
+            self._fst_batch(data_arr, out.reshape((-1, self.num, self.fft_length)))
+        return out
+
+    def fst_into(self, data_arr, real_out, imag_out):
+        """
+        Get spectrogram data into caller-provided real and imaginary arrays
+
+        The C routine writes straight into `real_out` and `imag_out`, without any
+        intermediate array.
+
+        Parameters
+        ----------
+        data_arr: np.ndarray [shape=(..., 2**radix2_exp)]
+            Input audio data
+
+        real_out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
+            C-contiguous array receiving the real part.
+
+        imag_out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
+            C-contiguous array receiving the imaginary part.
+
+        Returns
+        -------
+        real_out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
+
+        imag_out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
+        """
+        data_arr = ascontiguous_float32(data_arr)
+        check_audio(data_arr, is_mono=False)
+        if data_arr.shape[-1] != self.fft_length:
+            data_arr = check_audio_length(data_arr, self.radix2_exp)
+
+        shape = (*data_arr.shape[:-1], self.num, self.fft_length)
+        check_out_arr(real_out, shape, np.float32)
+        check_out_arr(imag_out, shape, np.float32)
+
+        if data_arr.ndim == 1:
+            self._fst(data_arr, real_out, imag_out)
+        else:
+            data_arr, _ = format_channel(data_arr, 1)
+            m_real_arr, _ = format_channel(real_out, 2)
+            m_imag_arr, _ = format_channel(imag_out, 2)
+            for i in range(data_arr.shape[0]):
+                self._fst(data_arr[i], m_real_arr[i], m_imag_arr[i])
+        return real_out, imag_out
+
+    def fst_batch(self, data_arr, num_workers=1):
         """
+        Get spectrogram data of a batch of signals
+
+        The result is written into a single preallocated array.
+
+        Parameters
+        ----------
+        data_arr: np.ndarray [shape=(batch, 2**radix2_exp)]
+            Input audio data
+
+        num_workers: int or None
+            Number of threads. Each extra thread uses its own FST object with the same
+            parameters, created for this call only. The C routine releases the GIL, so the
+            threads run in parallel. If None, ``os.cpu_count()`` is used.
 
-        data_arr = np.asarray(data_arr, dtype=np.float32, order='C')
+        Returns
+        -------
+        out: np.ndarray [shape=(batch, fre, time), dtype=np.complex64]
+        """
+        data_arr = ascontiguous_float32(data_arr)
         check_audio(data_arr, is_mono=False)
-        data_arr = check_audio_length(data_arr, self.radix2_exp)
+        if data_arr.shape[-1] != self.fft_length:
+            data_arr = check_audio_length(data_arr, self.radix2_exp)
+
+        if data_arr.ndim != 2:
+            raise ValueError(f'data_arr must be a 2D array of shape (batch, fft_length), given shape={data_arr.shape}')
+
+        m_ret_arr = np.empty((data_arr.shape[0], self.num, self.fft_length), dtype=np.complex64)
+        return self._fst_batch(data_arr, m_ret_arr, num_workers)
+
+    def _fst_batch(self, data_arr, m_ret_arr, num_workers=1):
+        batch_num = data_arr.shape[0]
+
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        num_workers = max(min(num_workers, batch_num), 1)
+        if num_workers == 1:
+            self._fst_rows(data_arr, range(batch_num), m_ret_arr)
+            return m_ret_arr
+
+        # workers are created per call and released when it returns
+        obj_list = [self] + [self._new_worker() for _ in range(num_workers - 1)]
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            future_list = [executor.submit(obj._fst_rows, data_arr, range(i, batch_num, num_workers), m_ret_arr)
+                           for i, obj in enumerate(obj_list)]
+            for future in future_list:
+                future.result()
+        return m_ret_arr
 
-        st_fn = self._lib['fstObj_fst']
-        st_fn.argtypes = [POINTER(OpaqueFST),
-                          np.ctypeslib.ndpointer(dtype=np.float32, ndim=1, flags='C_CONTIGUOUS'),
-                          c_int,
-                          c_int,
-                          np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags='C_CONTIGUOUS'),
-                          np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags='C_CONTIGUOUS'),
-                          ]
+    def _fst_rows(self, data_arr, index_arr, m_ret_arr):
+        for i in index_arr:
+            self._fst_complex(data_arr[i], m_ret_arr[i])
+
+    def _new_worker(self):
+        return FST(radix2_exp=self.radix2_exp, min_index=self.min_index, max_index=self.max_index,
+                   samplate=self.samplate)
+
+    def fst_magnitude(self, data_arr):
+        """
+        Get spectrogram magnitude data
+
+        Same as ``np.abs(obj.fst(data_arr))``, but computed in float32 directly
+        from the real and imaginary parts, without building the complex matrix.
+
+        Parameters
+        ----------
+        data_arr: np.ndarray [shape=(..., 2**radix2_exp)]
+            Input audio data
+
+        Returns
+        -------
+        out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
+        """
+
+        data_arr = ascontiguous_float32(data_arr)
+        check_audio(data_arr, is_mono=False)
+        if data_arr.shape[-1] != self.fft_length:
+            data_arr = check_audio_length(data_arr, self.radix2_exp)
 
         if data_arr.ndim == 1:
-            m_real_arr = np.zeros((self.num, self.fft_length), dtype=np.float32)
-            m_imag_arr = np.zeros((self.num, self.fft_length), dtype=np.float32)
-            st_fn(self._obj, data_arr, c_int(self.min_index), c_int(self.max_index), m_real_arr, m_imag_arr)
-            m_ret_arr = m_real_arr + (m_imag_arr * 1j)
+            m_real_arr, m_imag_arr = self._fst(data_arr)
+            m_mag_arr = np.hypot(m_real_arr, m_imag_arr)
         else:
             data_arr, o_channel_shape = format_channel(data_arr, 1)
             channel_num = data_arr.shape[0]
 
-            m_real_arr = np.zeros((channel_num, self.num, self.fft_length), dtype=np.float32)
-            m_imag_arr = np.zeros((channel_num, self.num, self.fft_length), dtype=np.float32)
+            m_mag_arr = np.empty((channel_num, self.num, self.fft_length), dtype=np.float32)
             for i in range(channel_num):
-                st_fn(self._obj, data_arr[i], c_int(self.min_index), c_int(self.max_index),
-                      m_real_arr[i], m_imag_arr[i])
-            m_ret_arr = m_real_arr + (m_imag_arr * 1j)
-            m_ret_arr = revoke_channel(m_ret_arr, o_channel_shape, 2)
-
-        return m_ret_arr
+                m_real_arr, m_imag_arr = self._fst(data_arr[i])
+                np.hypot(m_real_arr, m_imag_arr, out=m_mag_arr[i])
+            m_mag_arr = revoke_channel(m_mag_arr, o_channel_shape, 2)
+        return m_mag_arr
 
     def y_coords(self):
         """
@@ -171,10 +381,9 @@ class FST(Base):
         Returns
         -------
         out: np.ndarray [shape=(fre,)]
+            Cached on the object, read-only.
         """
-        fre_band_arr = self.get_fre_band_arr()
-        y_coords = np.insert(fre_band_arr, 0, fre_band_arr[0])
-        return y_coords
+        return self._y_coords
 
     def x_coords(self):
         """
@@ -183,13 +392,10 @@ class FST(Base):
         Returns
         -------
         out: [shape=(time,)]
+            Cached on the object, read-only.
         """
-        x_coords = np.linspace(0, self.fft_length / self.samplate, self.fft_length + 1)
-        return x_coords
+        return self._x_coords
 
     def __del__(self):
         if self._is_created:
-            free_fn = self._lib['fstObj_free']
-            free_fn.argtypes = [POINTER(OpaqueFST)]
-            free_fn.restype = c_void_p
-            free_fn(self._obj)
+            self._free_fn(self._obj)
@@ -0,0 +1,151 @@
+import numpy as np
+
+from audioflux.st import ST
+from audioflux.utils import check_audio_length
+
+try:
+    import cupy as cp
+except ImportError:
+    cp = None
+
+__all__ = ['STGPU']
+
+
+class STGPU(ST):
+    """
+    S-Transform (ST) with a CUDA path through CuPy
+
+    `st` computes the transform on the device when it is given a ``cupy.ndarray``, so a
+    pipeline that already keeps audio on the GPU does not pay for a round trip through host
+    memory. Inputs that are ``np.ndarray``, or any input when CuPy is not installed, use
+    the C implementation of `ST`.
+
+    The device path runs one forward FFT of the audio, multiplies the shifted spectrum by
+    every scale's gaussian window at once, and runs one batched inverse FFT over all scales.
+    The float32 window matrix is built on the device once, in ``__init__`` and in
+    `set_value`; the shifted spectra are a strided view of the doubled spectrum.
+
+    .. Note:: After `use_bin_arr`, device inputs are copied to the host and computed by `ST`.
+
+    Parameters
+    ----------
+    radix2_exp: int
+        ``fft_length=2**radix2_exp``
+
+    min_index: int
+        Min bank index.
+
+        Available range: [1, max_index)
+
+    max_index: int
+        Max bank index.
+
+        Available range: (min_index, fft_length/2)
+
+    samplate: int
+        Sampling rate of the incoming audio
+
+    factor: float
+        Factor value
+
+    norm: float
+        Norm value
+
+    See Also
+    --------
+    ST
+
+    Examples
+    --------
+
+    >>> import cupy as cp
+    >>> import audioflux as af
+    >>> from audioflux.gpu import STGPU
+    >>> audio_arr, sr = af.read(af.utils.sample_path('880'))
+    >>> obj = STGPU(radix2_exp=12, samplate=sr, min_index=1, max_index=1024)
+    >>> spec_arr = obj.st(cp.asarray(audio_arr[..., :4096]))
+    """
+
+    def __init__(self, radix2_exp=12, min_index=1, max_index=None, samplate=32000, factor=1., norm=1.):
+        super(STGPU, self).__init__(radix2_exp=radix2_exp, min_index=min_index, max_index=max_index,
+                                    samplate=samplate, factor=factor, norm=norm)
+
+        self._win_gpu = None
+        if cp is not None:
+            self._init_gpu_data()
+
+    def _init_gpu_data(self):
+        # same gaussian windows as stObj_new, one row per scale, built in float32 on the device
+        self._win_gpu = None
+        bin_arr = cp.arange(self.min_index, self.max_index + 1, dtype=cp.float32)[:, None]
+        n_arr = cp.arange(self.fft_length, dtype=cp.float32)
+        value_arr = (-self.factor * 2 * np.pi ** 2) / bin_arr ** (2 * self.norm)
+
+        win_arr = value_arr * (n_arr * n_arr)
+        cp.exp(win_arr, out=win_arr)
+        e_arr = value_arr * ((n_arr - self.fft_length) ** 2)
+        cp.exp(e_arr, out=e_arr)
+        win_arr += e_arr
+        self._win_gpu = win_arr
+
+    def set_value(self, factor, norm):
+        """
+        Set value
+
+        Parameters
+        ----------
+        factor: float
+            Factor value
+
+        norm: float
+            Norm value
+        """
+        super(STGPU, self).set_value(factor, norm)
+        if cp is not None:
+            self._init_gpu_data()
+
+    def st(self, data_arr, out=None):
+        """
+        Get spectrogram data
+
+        Parameters
+        ----------
+        data_arr: np.ndarray or cupy.ndarray [shape=(..., 2**radix2_exp)]
+            Input audio data
+
+        out: None or np.ndarray [shape=(..., fre, time), dtype=np.complex64]
+            If given, the result is written into this C-contiguous array and returned.
+            Only supported for ``np.ndarray`` input.
+
+        Returns
+        -------
+        out: np.ndarray or cupy.ndarray [shape=(..., fre, time), dtype=complex64]
+            A ``cupy.ndarray`` when `data_arr` is one.
+        """
+        if cp is None or not isinstance(data_arr, cp.ndarray):
+            return super(STGPU, self).st(data_arr, out=out)
+
+        if out is not None:
+            raise ValueError('out is not supported for cupy.ndarray input')
+
+        if self._bin_arr is not None:
+            return cp.asarray(super(STGPU, self).st(cp.asnumpy(data_arr)))
+        return self._st_gpu(data_arr)
+
+    def _st_gpu(self, data_arr):
+        if data_arr.ndim == 0:
+            raise ValueError('Audio data must have at least one dimension')
+        data_arr = data_arr.astype(cp.float32, copy=False)
+        if data_arr.shape[-1] != self.fft_length:
+            data_arr = check_audio_length(data_arr, self.radix2_exp)
+
+        fft_arr = cp.fft.fft(data_arr, axis=-1)
+        fft_arr = cp.concatenate((fft_arr, fft_arr), axis=-1)
+
+        # (..., 2*fftLength) -> (..., num, fftLength) view, row i starts at bin min_index+i
+        item_size = fft_arr.itemsize
+        shift_arr = cp.lib.stride_tricks.as_strided(fft_arr[..., self.min_index:],
+                                                    shape=(*fft_arr.shape[:-1], self.num, self.fft_length),
+                                                    strides=(*fft_arr.strides[:-1], item_size, item_size))
+        m_fft_arr = shift_arr * self._win_gpu
+        return cp.fft.ifft(m_fft_arr, axis=-1).astype(cp.complex64, copy=False)
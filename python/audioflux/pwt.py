@@ -1,10 +1,13 @@
+import os
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-from ctypes import Structure, POINTER, pointer, c_int, c_float, c_void_p
+from ctypes import Structure, POINTER, pointer, byref, c_int, c_float, c_void_p
 from audioflux.type import SpectralFilterBankScaleType, SpectralFilterBankStyleType, SpectralFilterBankNormalType
 from audioflux.base import Base
-from audioflux.utils import check_audio, check_audio_length, format_channel, revoke_channel, note_to_hz
+from audioflux.utils import (ascontiguous_float32, check_audio, check_audio_length, check_out_arr, format_channel,
+                             revoke_channel, note_to_hz)
 
 __all__ = ["PWT"]
 
@@ -17,6 +20,10 @@ class PWT(Base):
     """
     Pseudo Wavelet Transform (PWT).
 
+    .. Note:: An object reuses its own work buffers on every call, so it must not be used
+              from several threads at once. Use one object per thread, or `pwt_batch` with
+              ``num_workers > 1``, which runs a separate object in each worker thread.
+
     Parameters
     ----------
     num: int
@@ -162,23 +169,72 @@ class PWT(Base):
         self.normal_type = normal_type
         self.is_padding = is_padding
 
+        self._x_coords = np.linspace(0, self.fft_length / self.samplate, self.fft_length + 1, dtype=np.float32)
+        self._x_coords.setflags(write=False)
+
+        self._free_fn = self._lib['pwtObj_free']
+        self._free_fn.argtypes = [POINTER(OpaquePWT)]
+        self._free_fn.restype = c_void_p
+
         fn = self._lib['pwtObj_new']
         fn.argtypes = [POINTER(POINTER(OpaquePWT)), c_int, c_int,
                        POINTER(c_int), POINTER(c_float), POINTER(c_float), POINTER(c_int),
                        POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int)]
+        samplate = c_int(self.samplate)
+        low_fre = c_float(self.low_fre)
+        high_fre = c_float(self.high_fre)
+        bin_per_octave = c_int(self.bin_per_octave)
+        scale_type = c_int(self.scale_type.value)
+        style_type = c_int(self.style_type.value)
+        normal_type = c_int(self.normal_type.value)
+        is_padding = c_int(int(self.is_padding))
         fn(self._obj,
            c_int(self.num),
            c_int(self.radix2_exp),
-           pointer(c_int(self.samplate)),
-           pointer(c_float(self.low_fre)),
-           pointer(c_float(self.high_fre)),
-           pointer(c_int(self.bin_per_octave)),
-           pointer(c_int(self.scale_type.value)),
-           pointer(c_int(self.style_type.value)),
-           pointer(c_int(self.normal_type.value)),
-           pointer(c_int(int(self.is_padding))))
+           byref(samplate),
+           byref(low_fre),
+           byref(high_fre),
+           byref(bin_per_octave),
+           byref(scale_type),
+           byref(style_type),
+           byref(normal_type),
+           byref(is_padding))
         self._is_created = True
 
+        self._pwt_fn = self._lib['pwtObj_pwt']
+        self._pwt_fn.argtypes = [POINTER(OpaquePWT),
+                                 np.ctypeslib.ndpointer(dtype=np.float32, ndim=1, flags='C_CONTIGUOUS'),
+                                 np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags='C_CONTIGUOUS'),
+                                 np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags='C_CONTIGUOUS'),
+                                 ]
+
+        # Per-object buffers the C routine writes into; results are always copied
+        # out of them, so an object must not be used from several threads at once.
+        self._m_real_arr = np.empty((self.num, self.fft_length), dtype=np.float32)
+        self._m_imag_arr = np.empty((self.num, self.fft_length), dtype=np.float32)
+
+        # The band arrays are fixed once the filter bank is built in pwtObj_new,
+        # so copy them out here instead of calling into C on every access.
+        fn = self._lib['pwtObj_getFreBandArr']
+        fn.argtypes = [POINTER(OpaquePWT)]
+        fn.restype = c_void_p
+        p = fn(self._obj)
+        self._fre_band_arr = np.frombuffer((c_float * self.num).from_address(p), np.float32).copy()
+        self._fre_band_arr.setflags(write=False)
+        self._y_coords = np.empty(self.num + 1, dtype=np.float32)
+        self._y_coords[0] = self.low_fre
+        self._y_coords[1:] = self._fre_band_arr
+        self._y_coords.setflags(write=False)
+
+        fn = self._lib['pwtObj_getBinBandArr']
+        fn.argtypes = [POINTER(OpaquePWT)]
+        fn.restype = c_void_p
+        p = fn(self._obj)
+        self._bin_band_arr = np.frombuffer((c_int * self.num).from_address(p), np.int32).copy()
+        self._bin_band_arr.setflags(write=False)
+
+        self._pwt_complex = self._new_pwt_complex()
+
     def get_fre_band_arr(self):
         """
         Get an array of frequency bands of different scales.
@@ -187,14 +243,10 @@ class PWT(Base):
         Returns
         -------
         out: np.ndarray [shape=(fre, )]
+            Cached on the object, read-only.
         """
 
-        fn = self._lib['pwtObj_getFreBandArr']
-        fn.argtypes = [POINTER(OpaquePWT)]
-        fn.restype = c_void_p
-        p = fn(self._obj)
-        ret = np.frombuffer((c_float * self.num).from_address(p), np.float32).copy()
-        return ret
+        return self._fre_band_arr
 
     def get_bin_band_arr(self):
         """
@@ -203,16 +255,31 @@ class PWT(Base):
         Returns
         -------
         out: np.ndarray [shape=[n_bin,]]
+            Cached on the object, read-only.
         """
 
-        fn = self._lib['pwtObj_getBinBandArr']
-        fn.argtypes = [POINTER(OpaquePWT)]
-        fn.restype = c_void_p
-        p = fn(self._obj)
-        ret = np.frombuffer((c_int * self.num).from_address(p), np.int32).copy()
-        return ret
+        return self._bin_band_arr
+
+    def _pwt(self, data_arr, m_real_arr=None, m_imag_arr=None):
+        if m_real_arr is None:
+            m_real_arr, m_imag_arr = self._m_real_arr, self._m_imag_arr
+        self._pwt_fn(self._obj, data_arr, m_real_arr, m_imag_arr)
+        return m_real_arr, m_imag_arr
+
+    def _new_pwt_complex(self):
+        # Bind everything that is fixed for the object's lifetime, so the per-row
+        # call does no attribute lookups.
+        obj = self._obj
+        pwt_fn = self._pwt_fn
+        m_real_arr, m_imag_arr = self._m_real_arr, self._m_imag_arr
+
+        def _pwt_complex(data_arr, m_ret_arr):
+            pwt_fn(obj, data_arr, m_real_arr, m_imag_arr)
+            m_ret_arr.real = m_real_arr
+            m_ret_arr.imag = m_imag_arr
+        return _pwt_complex
 
-    def pwt(self, data_arr):
+    def pwt(self, data_arr, out=None):
         """
         Get spectrogram data
 
@@ -221,40 +288,172 @@ class PWT(Base):
         data_arr: np.ndarray [shape=(..., 2**radix2_exp)]
             Audio data array
 
+        out: None or np.ndarray [shape=(..., fre, time), dtype=np.complex64]
+            If given, the result is written into this C-contiguous array and returned.
+
         Returns
         -------
-        out: np.ndarray [shape=(..., fre, time), dtype=np.complex]
+        out: np.ndarray [shape=(..., fre, time), dtype=np.complex64]
             The matrix of PWT
         """
+        data_arr = ascontiguous_float32(data_arr)
+        check_audio(data_arr, is_mono=False)
+        if data_arr.shape[-1] != self.fft_length:
+            data_arr = check_audio_length(data_arr, self.radix2_exp)
+
+        shape = (*data_arr.shape[:-1], self.num, self.fft_length)
+        if out is None:
+            out = np.empty(shape, dtype=np.complex64)
+        else:
+            check_out_arr(out, shape, np.complex64)
+
+        if data_arr.ndim == 1:
+            self._pwt_complex(data_arr, out)
+        else:
+            data_arr, _ = format_channel(data_arr, 1)
+            self._pwt_batch(data_arr, out.reshape((-1, self.num, self.fft_length)))
+        return out
+
+    def pwt_into(self, data_arr, real_out, imag_out):
+        """
+        Get spectrogram data into caller-provided real and imaginary arrays
+
+        The C routine writes straight into `real_out` and `imag_out`, without any
+        intermediate array.
+
+        Parameters
+        ----------
+        data_arr: np.ndarray [shape=(..., 2**radix2_exp)]
+            Audio data array
 
-        data_arr = np.asarray(data_arr, dtype=np.float32, order='C')
+        real_out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
+            C-contiguous array receiving the real part.
+
+        imag_out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
+            C-contiguous array receiving the imaginary part.
+
+        Returns
+        -------
+        real_out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
+
+        imag_out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
+        """
+        data_arr = ascontiguous_float32(data_arr)
         check_audio(data_arr, is_mono=False)
-        data_arr = check_audio_length(data_arr, self.radix2_exp)
+        if data_arr.shape[-1] != self.fft_length:
+            data_arr = check_audio_length(data_arr, self.radix2_exp)
 
-        fn = self._lib['pwtObj_pwt']
-        fn.argtypes = [POINTER(OpaquePWT),
-                       np.ctypeslib.ndpointer(dtype=np.float32, ndim=1, flags='C_CONTIGUOUS'),
-                       np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags='C_CONTIGUOUS'),
-                       np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags='C_CONTIGUOUS'),
-                       ]
+        shape = (*data_arr.shape[:-1], self.num, self.fft_length)
+        check_out_arr(real_out, shape, np.float32)
+        check_out_arr(imag_out, shape, np.float32)
 
         if data_arr.ndim == 1:
-            m_real_arr = np.zeros((self.num, self.fft_length), dtype=np.float32)
-            m_imag_arr = np.zeros((self.num, self.fft_length), dtype=np.float32)
-            fn(self._obj, data_arr, m_real_arr, m_imag_arr)
-            m_pwt_arr = m_real_arr + m_imag_arr * 1j
+            self._pwt(data_arr, real_out, imag_out)
+        else:
+            data_arr, _ = format_channel(data_arr, 1)
+            m_real_arr, _ = format_channel(real_out, 2)
+            m_imag_arr, _ = format_channel(imag_out, 2)
+            for i in range(data_arr.shape[0]):
+                self._pwt(data_arr[i], m_real_arr[i], m_imag_arr[i])
+        return real_out, imag_out
+
+    def pwt_batch(self, data_arr, num_workers=1):
+        """
+        Get spectrogram data of a batch of signals
+
+        The result is written into a single preallocated array.
+
+        Parameters
+        ----------
+        data_arr: np.ndarray [shape=(batch, 2**radix2_exp)]
+            Audio data array
+
+        num_workers: int or None
+            Number of threads. Each extra thread uses its own PWT object with the same
+            parameters, created for this call only. The C routine releases the GIL, so the
+            threads run in parallel. If None, ``os.cpu_count()`` is used.
+
+        Returns
+        -------
+        out: np.ndarray [shape=(batch, fre, time), dtype=np.complex64]
+            The matrix of PWT
+        """
+        data_arr = ascontiguous_float32(data_arr)
+        check_audio(data_arr, is_mono=False)
+        if data_arr.shape[-1] != self.fft_length:
+            data_arr = check_audio_length(data_arr, self.radix2_exp)
+
+        if data_arr.ndim != 2:
+            raise ValueError(f'data_arr must be a 2D array of shape (batch, fft_length), given shape={data_arr.shape}')
+
+        m_pwt_arr = np.empty((data_arr.shape[0], self.num, self.fft_length), dtype=np.complex64)
+        return self._pwt_batch(data_arr, m_pwt_arr, num_workers)
+
+    def _pwt_batch(self, data_arr, m_pwt_arr, num_workers=1):
+        batch_num = data_arr.shape[0]
+
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        num_workers = max(min(num_workers, batch_num), 1)
+        if num_workers == 1:
+            self._pwt_rows(data_arr, range(batch_num), m_pwt_arr)
+            return m_pwt_arr
+
+        # workers are created per call and released when it returns
+        obj_list = [self] + [self._new_worker() for _ in range(num_workers - 1)]
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            future_list = [executor.submit(obj._pwt_rows, data_arr, range(i, batch_num, num_workers), m_pwt_arr)
+                           for i, obj in enumerate(obj_list)]
+            for future in future_list:
+                future.result()
+        return m_pwt_arr
+
+    def _pwt_rows(self, data_arr, index_arr, m_pwt_arr):
+        for i in index_arr:
+            self._pwt_complex(data_arr[i], m_pwt_arr[i])
+
+    def _new_worker(self):
+        return PWT(num=self.num, radix2_exp=self.radix2_exp, samplate=self.samplate,
+                   low_fre=self.low_fre, high_fre=self.high_fre, bin_per_octave=self.bin_per_octave,
+                   scale_type=self.scale_type, style_type=self.style_type, normal_type=self.normal_type,
+                   is_padding=self.is_padding)
+
+    def pwt_magnitude(self, data_arr):
+        """
+        Get spectrogram magnitude data
+
+        Same as ``np.abs(obj.pwt(data_arr))``, but computed in float32 directly
+        from the real and imaginary parts, without building the complex matrix.
+
+        Parameters
+        ----------
+        data_arr: np.ndarray [shape=(..., 2**radix2_exp)]
+            Audio data array
+
+        Returns
+        -------
+        out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
+            The magnitude matrix of PWT
+        """
+
+        data_arr = ascontiguous_float32(data_arr)
+        check_audio(data_arr, is_mono=False)
+        if data_arr.shape[-1] != self.fft_length:
+            data_arr = check_audio_length(data_arr, self.radix2_exp)
+
+        if data_arr.ndim == 1:
+            m_real_arr, m_imag_arr = self._pwt(data_arr)
+            m_mag_arr = np.hypot(m_real_arr, m_imag_arr)
         else:
             data_arr, o_channel_shape = format_channel(data_arr, 1)
             channel_num = data_arr.shape[0]
 
-            m_real_arr = np.zeros((channel_num, self.num, self.fft_length), dtype=np.float32)
-            m_imag_arr = np.zeros((channel_num, self.num, self.fft_length), dtype=np.float32)
+            m_mag_arr = np.empty((channel_num, self.num, self.fft_length), dtype=np.float32)
             for i in range(channel_num):
-                fn(self._obj, data_arr[i], m_real_arr[i], m_imag_arr[i])
-            m_pwt_arr = m_real_arr + m_imag_arr * 1j
-            m_pwt_arr = revoke_channel(m_pwt_arr, o_channel_shape, 2)
-
-        return m_pwt_arr
+                m_real_arr, m_imag_arr = self._pwt(data_arr[i])
+                np.hypot(m_real_arr, m_imag_arr, out=m_mag_arr[i])
+            m_mag_arr = revoke_channel(m_mag_arr, o_channel_shape, 2)
+        return m_mag_arr
 
     def y_coords(self):
         """
@@ -263,10 +462,9 @@ class PWT(Base):
         Returns
         -------
         out: np.ndarray [shape=(fre,)]
+            Cached on the object, read-only.
         """
-        y_coords = self.get_fre_band_arr()
-        y_coords = np.insert(y_coords, 0, self.low_fre)
-        return y_coords
+        return self._y_coords
 
     def x_coords(self):
         """
@@ -275,13 +473,10 @@ class PWT(Base):
         Returns
         -------
         out: np.ndarray [shape=(time,)]
+            Cached on the object, read-only.
         """
-        x_coords = np.linspace(0, self.fft_length / self.samplate, self.fft_length + 1)
-        return x_coords
+        return self._x_coords
 
     def __del__(self):
         if self._is_created:
-            fn = self._lib['pwtObj_free']
-            fn.argtypes = [POINTER(OpaquePWT)]
-            fn.restype = c_void_p
-            fn(self._obj)
+            self._free_fn(self._obj)
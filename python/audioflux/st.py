@@ -1,9 +1,12 @@
+import os
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from ctypes import Structure, POINTER, pointer, c_int, c_float, c_void_p
 from audioflux.base import Base
-from audioflux.utils import check_audio, check_audio_length, format_channel, revoke_channel
+from audioflux.utils import (ascontiguous_float32, check_audio, check_audio_length, check_out_arr, format_channel,
+                             revoke_channel)
 
 __all__ = ['ST']
 
@@ -16,6 +19,10 @@ class ST(Base):
     """
     S-Transform (ST)
 
+    .. Note:: An object reuses its own work buffers on every call, so it must not be used
+              from several threads at once. Use one object per thread, or `st_batch` with
+              ``num_workers > 1``, which runs a separate object in each worker thread.
+
     Parameters
     ----------
     radix2_exp: int
@@ -109,6 +116,21 @@ class ST(Base):
         self.fft_length = fft_length
         self.num = self.max_index - self.min_index + 1
 
+        self._bin_arr = None
+        ratio = self.samplate / self.fft_length
+        self._fre_band_arr = np.linspace(self.min_index * ratio, self.max_index * ratio, self.num, dtype=np.float32)
+        self._fre_band_arr.setflags(write=False)
+        self._x_coords = np.linspace(0, self.fft_length / self.samplate, self.fft_length + 1, dtype=np.float32)
+        self._x_coords.setflags(write=False)
+        self._y_coords = np.empty(self.num + 1, dtype=np.float32)
+        self._y_coords[0] = self._fre_band_arr[0]
+        self._y_coords[1:] = self._fre_band_arr
+        self._y_coords.setflags(write=False)
+
+        self._free_fn = self._lib['stObj_free']
+        self._free_fn.argtypes = [POINTER(OpaqueST)]
+        self._free_fn.restype = c_void_p
+
         fn = self._lib['stObj_new']
         fn.argtypes = [POINTER(POINTER(OpaqueST)), c_int, c_int, c_int,
                        POINTER(c_float), POINTER(c_float)]
@@ -120,6 +142,30 @@ class ST(Base):
            pointer(c_float(self.norm)))
         self._is_created = True
 
+        self._use_bin_arr_fn = self._lib['stObj_useBinArr']
+        self._use_bin_arr_fn.argtypes = [POINTER(OpaqueST),
+                                         np.ctypeslib.ndpointer(dtype=np.float32, ndim=1, flags='C_CONTIGUOUS'),
+                                         c_int]
+
+        self._set_value_fn = self._lib['stObj_setValue']
+        self._set_value_fn.argtypes = [POINTER(OpaqueST), c_float, c_float]
+
+        self._st_fn = self._lib['stObj_st']
+        self._st_fn.argtypes = [POINTER(OpaqueST),
+                                np.ctypeslib.ndpointer(dtype=np.float32, ndim=1, flags='C_CONTIGUOUS'),
+                                np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags='C_CONTIGUOUS'),
+                                np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags='C_CONTIGUOUS'),
+                                ]
+
+        # Per-object buffers the C routine writes into; results are always copied
+        # out of them, so an object must not be used from several threads at once.
+        # Zeroed because stObj_st skips the imaginary part of a zero bin and
+        # only writes binLength rows.
+        self._m_real_arr = np.zeros((self.num, self.fft_length), dtype=np.float32)
+        self._m_imag_arr = np.zeros((self.num, self.fft_length), dtype=np.float32)
+
+        self._st_complex = self._new_st_complex()
+
     def use_bin_arr(self, bin_arr):
         """
         Use bin arr
@@ -128,16 +174,17 @@ class ST(Base):
         ----------
         bin_arr: np.ndarray [shape=(n,)]
         """
-        bin_arr = np.asarray(bin_arr, dtype=np.float32, order='C')
+        bin_arr = ascontiguous_float32(bin_arr)
         if bin_arr.ndim != 1:
             raise ValueError('bin_arr is only defined for 1D arrays')
 
         length = bin_arr.shape[0]
-        user_bin_arr_fn = self._lib['stObj_useBinArr']
-        user_bin_arr_fn.argtypes = [POINTER(OpaqueST),
-                                    np.ctypeslib.ndpointer(dtype=np.float32, ndim=1, flags='C_CONTIGUOUS'),
-                                    c_int]
-        user_bin_arr_fn(self._obj, bin_arr, c_int(length))
+        self._use_bin_arr_fn(self._obj, bin_arr, c_int(length))
+        self._bin_arr = bin_arr.copy()
+
+        # rows or imaginary parts the new bins skip must not keep data from earlier calls
+        self._m_real_arr.fill(0)
+        self._m_imag_arr.fill(0)
 
     def set_value(self, factor, norm):
         """
@@ -151,9 +198,7 @@ class ST(Base):
         norm: float
             Norm value
         """
-        set_value_fn = self._lib['stObj_setValue']
-        set_value_fn.argtypes = [POINTER(OpaqueST), c_float, c_float]
-        set_value_fn(self._obj, c_float(factor), c_float(norm))
+        self._set_value_fn(self._obj, c_float(factor), c_float(norm))
         self.factor = factor
         self.norm = norm
 
@@ -164,10 +209,30 @@ class ST(Base):
         Returns
         -------
         out: np.ndarray [shape=(n_fre,)]
+            Cached on the object, read-only.
         """
-        return np.arange(self.min_index, self.max_index + 1, dtype=np.float32) * self.samplate / self.fft_length
-
-    def st(self, data_arr):
+        return self._fre_band_arr
+
+    def _st(self, data_arr, m_real_arr=None, m_imag_arr=None):
+        if m_real_arr is None:
+            m_real_arr, m_imag_arr = self._m_real_arr, self._m_imag_arr
+        self._st_fn(self._obj, data_arr, m_real_arr, m_imag_arr)
+        return m_real_arr, m_imag_arr
+
+    def _new_st_complex(self):
+        # Bind everything that is fixed for the object's lifetime, so the per-row
+        # call does no attribute lookups.
+        obj = self._obj
+        st_fn = self._st_fn
+        m_real_arr, m_imag_arr = self._m_real_arr, self._m_imag_arr
+
+        def _st_complex(data_arr, m_ret_arr):
+            st_fn(obj, data_arr, m_real_arr, m_imag_arr)
+            m_ret_arr.real = m_real_arr
+            m_ret_arr.imag = m_imag_arr
+        return _st_complex
+
+    def st(self, data_arr, out=None):
         """
         Get spectrogram data
 
@@ -176,39 +241,173 @@ class ST(Base):
         data_arr: np.ndarray [shape=(..., 2**radix2_exp)]
             Input audio data
 
+        out: None or np.ndarray [shape=(..., fre, time), dtype=np.complex64]
+            If given, the result is written into this C-contiguous array and returned.
+
+        Returns
+        -------
+        out: np.ndarray [shape=(..., fre, time), dtype=np.complex64]
+        """
+        data_arr = ascontiguous_float32(data_arr)
+        check_audio(data_arr, is_mono=False)
+        if data_arr.shape[-1] != self.fft_length:
+            data_arr = check_audio_length(data_arr, self.radix2_exp)
+
+        shape = (*data_arr.shape[:-1], self.num, self.fft_length)
+        if out is None:
+            out = np.empty(shape, dtype=np.complex64)
+        else:
+            check_out_arr(out, shape, np.complex64)
+
+        if data_arr.ndim == 1:
+            self._st_complex(data_arr, out)
+        else:
+            data_arr, _ = format_channel(data_arr, 1)
+            self._st_batch(data_arr, out.reshape((-1, self.num, self.fft_length)))
+        return out
+
+    def st_into(self, data_arr, real_out, imag_out):
+        """
+        Get spectrogram data into caller-provided real and imaginary arrays
+
+        The C routine writes straight into `real_out` and `imag_out`, without any
+        intermediate array.
+
+        Parameters
+        ----------
+        data_arr: np.ndarray [shape=(..., 2**radix2_exp)]
+            Input audio data
+
+        real_out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
+            C-contiguous array receiving the real part.
+
+        imag_out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
+            C-contiguous array receiving the imaginary part.
+
         Returns
         -------
-        out: np.ndarray [shape=(..., fre, time), dtype=np.complex]
+        real_out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
+
+        imag_out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
         """
-        data_arr = np.asarray(data_arr, dtype=np.float32, order='C')
+        data_arr = ascontiguous_float32(data_arr)
         check_audio(data_arr, is_mono=False)
-        data_arr = check_audio_length(data_arr, self.radix2_exp)
+        if data_arr.shape[-1] != self.fft_length:
+            data_arr = check_audio_length(data_arr, self.radix2_exp)
 
-        st_fn = self._lib['stObj_st']
-        st_fn.argtypes = [POINTER(OpaqueST),
-                          np.ctypeslib.ndpointer(dtype=np.float32, ndim=1, flags='C_CONTIGUOUS'),
-                          np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags='C_CONTIGUOUS'),
-                          np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags='C_CONTIGUOUS'),
-                          ]
+        shape = (*data_arr.shape[:-1], self.num, self.fft_length)
+        check_out_arr(real_out, shape, np.float32)
+        check_out_arr(imag_out, shape, np.float32)
+        if self._bin_arr is not None:
+            # with a custom bin array, stObj_st may leave rows or imaginary parts unwritten
+            real_out.fill(0)
+            imag_out.fill(0)
 
         if data_arr.ndim == 1:
-            size = (self.num, self.fft_length)
-            m_real_arr = np.zeros(size, dtype=np.float32)
-            m_imag_arr = np.zeros(size, dtype=np.float32)
-            st_fn(self._obj, data_arr, m_real_arr, m_imag_arr)
-            m_st_arr = m_real_arr + m_imag_arr * 1j
+            self._st(data_arr, real_out, imag_out)
+        else:
+            data_arr, _ = format_channel(data_arr, 1)
+            m_real_arr, _ = format_channel(real_out, 2)
+            m_imag_arr, _ = format_channel(imag_out, 2)
+            for i in range(data_arr.shape[0]):
+                self._st(data_arr[i], m_real_arr[i], m_imag_arr[i])
+        return real_out, imag_out
+
+    def st_batch(self, data_arr, num_workers=1):
+        """
+        Get spectrogram data of a batch of signals
+
+        The result is written into a single preallocated array.
+
+        Parameters
+        ----------
+        data_arr: np.ndarray [shape=(batch, 2**radix2_exp)]
+            Input audio data
+
+        num_workers: int or None
+            Number of threads. Each extra thread uses its own ST object with the same
+            parameters, created for this call only. The C routine releases the GIL, so the
+            threads run in parallel. If None, ``os.cpu_count()`` is used.
+
+        Returns
+        -------
+        out: np.ndarray [shape=(batch, fre, time), dtype=np.complex64]
+        """
+        data_arr = ascontiguous_float32(data_arr)
+        check_audio(data_arr, is_mono=False)
+        if data_arr.shape[-1] != self.fft_length:
+            data_arr = check_audio_length(data_arr, self.radix2_exp)
+
+        if data_arr.ndim != 2:
+            raise ValueError(f'data_arr must be a 2D array of shape (batch, fft_length), given shape={data_arr.shape}')
+
+        m_st_arr = np.empty((data_arr.shape[0], self.num, self.fft_length), dtype=np.complex64)
+        return self._st_batch(data_arr, m_st_arr, num_workers)
+
+    def _st_batch(self, data_arr, m_st_arr, num_workers=1):
+        batch_num = data_arr.shape[0]
+
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        num_workers = max(min(num_workers, batch_num), 1)
+        if num_workers == 1:
+            self._st_rows(data_arr, range(batch_num), m_st_arr)
+            return m_st_arr
+
+        # workers are created per call and released when it returns
+        obj_list = [self] + [self._new_worker() for _ in range(num_workers - 1)]
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            future_list = [executor.submit(obj._st_rows, data_arr, range(i, batch_num, num_workers), m_st_arr)
+                           for i, obj in enumerate(obj_list)]
+            for future in future_list:
+                future.result()
+        return m_st_arr
+
+    def _st_rows(self, data_arr, index_arr, m_st_arr):
+        for i in index_arr:
+            self._st_complex(data_arr[i], m_st_arr[i])
+
+    def _new_worker(self):
+        obj = ST(radix2_exp=self.radix2_exp, min_index=self.min_index, max_index=self.max_index,
+                 samplate=self.samplate, factor=self.factor, norm=self.norm)
+        if self._bin_arr is not None:
+            obj.use_bin_arr(self._bin_arr)
+        return obj
+
+    def st_magnitude(self, data_arr):
+        """
+        Get spectrogram magnitude data
+
+        Same as ``np.abs(obj.st(data_arr))``, but computed in float32 directly
+        from the real and imaginary parts, without building the complex matrix.
+
+        Parameters
+        ----------
+        data_arr: np.ndarray [shape=(..., 2**radix2_exp)]
+            Input audio data
+
+        Returns
+        -------
+        out: np.ndarray [shape=(..., fre, time), dtype=np.float32]
+        """
+        data_arr = ascontiguous_float32(data_arr)
+        check_audio(data_arr, is_mono=False)
+        if data_arr.shape[-1] != self.fft_length:
+            data_arr = check_audio_length(data_arr, self.radix2_exp)
+
+        if data_arr.ndim == 1:
+            m_real_arr, m_imag_arr = self._st(data_arr)
+            m_mag_arr = np.hypot(m_real_arr, m_imag_arr)
         else:
             data_arr, o_channel_shape = format_channel(data_arr, 1)
             channel_num = data_arr.shape[0]
 
-            size = (channel_num, self.num, self.fft_length)
-            m_real_arr = np.zeros(size, dtype=np.float32)
-            m_imag_arr = np.zeros(size, dtype=np.float32)
+            m_mag_arr = np.empty((channel_num, self.num, self.fft_length), dtype=np.float32)
             for i in range(channel_num):
-                st_fn(self._obj, data_arr[i], m_real_arr[i], m_imag_arr[i])
-            m_st_arr = m_real_arr + m_imag_arr * 1j
-            m_st_arr = revoke_channel(m_st_arr, o_channel_shape, 2)
-        return m_st_arr
+                m_real_arr, m_imag_arr = self._st(data_arr[i])
+                np.hypot(m_real_arr, m_imag_arr, out=m_mag_arr[i])
+            m_mag_arr = revoke_channel(m_mag_arr, o_channel_shape, 2)
+        return m_mag_arr
 
     def y_coords(self):
         """
@@ -217,10 +416,9 @@ class ST(Base):
         Returns
         -------
         out: np.ndarray
+            Cached on the object, read-only.
         """
-        fre_band_arr = self.get_fre_band_arr()
-        y_coords = np.insert(fre_band_arr, 0, fre_band_arr[0])
-        return y_coords
+        return self._y_coords
 
     def x_coords(self):
         """
@@ -229,13 +427,10 @@ class ST(Base):
         Returns
         -------
         out: np.ndarray
+            Cached on the object, read-only.
         """
-        x_coords = np.linspace(0, self.fft_length / self.samplate, self.fft_length + 1)
-        return x_coords
+        return self._x_coords
 
     def __del__(self):
         if self._is_created:
-            free_fn = self._lib['stObj_free']
-            free_fn.argtypes = [POINTER(OpaqueST)]
-            free_fn.restype = c_void_p
-            free_fn(self._obj)
+            self._free_fn(self._obj)
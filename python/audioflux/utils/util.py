@@ -4,10 +4,12 @@ import numpy as np
 __all__ = [
     'ascontiguous_T',
     'ascontiguous_swapaxex',
+    'ascontiguous_float32',
     'format_channel',
     'revoke_channel',
     'check_audio',
-    'check_audio_length'
+    'check_audio_length',
+    'check_out_arr'
 ]
 
 
@@ -50,6 +52,28 @@ def ascontiguous_swapaxex(X, axis1, axis2, dtype=None, *args, **kwargs):
     return np.ascontiguousarray(np.swapaxes(X, axis1, axis2), dtype=dtype, *args, **kwargs)
 
 
+def ascontiguous_float32(X):
+    """
+    Return a float32 contiguous array in memory.
+
+    Unlike ``np.asarray(X, dtype=np.float32, order='C')``, an array that already
+    meets these requirements is returned as is, without going through the conversion.
+
+    Parameters
+    ----------
+    X: array_like
+        Input data.
+
+    Returns
+    -------
+    out: ndarray
+        X itself, or a float32 contiguous copy of it
+    """
+    if type(X) is np.ndarray and X.dtype == np.float32 and X.flags.c_contiguous:
+        return X
+    return np.asarray(X, dtype=np.float32, order='C')
+
+
 def format_channel(X, last_fixed_ndim):
     shape = X.shape
     return X.reshape((-1, *shape[-last_fixed_ndim:])), shape[:-last_fixed_ndim]
@@ -104,3 +128,40 @@ def check_audio_length(X, radix2_exp):
                       f'only the first fft_length={fft_length} data are valid')
         X = X[..., :fft_length].copy()
     return X
+
+
+def check_out_arr(X, shape, dtype):
+    """
+    check a caller-provided output array
+
+    Parameters
+    ----------
+    X: np.ndarray
+        output array
+
+    shape: tuple
+        expected shape
+
+    dtype: np.dtype
+        expected dtype
+
+    Returns
+    -------
+    out: bool
+    """
+    if not isinstance(X, np.ndarray):
+        raise ValueError('Output data must be of type np.ndarray')
+
+    if X.dtype != dtype:
+        raise ValueError(f'Output data must be of dtype={np.dtype(dtype).name}, given dtype={X.dtype}')
+
+    if X.shape != tuple(shape):
+        raise ValueError(f'Output data must be of shape={tuple(shape)}, given shape={X.shape}')
+
+    if not X.flags.c_contiguous:
+        raise ValueError("Output data must be C-contiguous")
+
+    if not X.flags.writeable:
+        raise ValueError("Output data must be writeable")
+
+    return True
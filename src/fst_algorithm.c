@@ -42,6 +42,9 @@ static void _fstObj_initFFT(FSTObj fstObj,int radix2Exp);
 static void _fstObj_initPartition(FSTObj fstObj,int length);
 static void _fstObj_initReassign(FSTObj fstObj,int radix2Exp);
 
+static void __fstObj_fst(FSTObj fstObj,float *dataArr,int minIndex,int maxIndex,
+						float *mRealArr,float *mImageArr,float *mComplexArr);
+
 static void __mget_fast(float *mRealArr1,float *mImageArr1, int *mIndexArr,
 				int length,int start,int end,
 				float *mRealArr3,float *mImageArr3);
@@ -111,6 +114,18 @@ int fstObj_new(FSTObj *fstObj,int radix2Exp){
 	3. 根据mIndex排列矩阵
 ****/
 void fstObj_fst(FSTObj fstObj,float *dataArr,int minIndex,int maxIndex,float *mRealArr,float *mImageArr){
+
+	__fstObj_fst(fstObj,dataArr,minIndex,maxIndex,mRealArr,mImageArr,NULL);
+}
+
+// mComplexArr interleaved real/image, (maxIndex-minIndex+1)*fftLength*2
+void fstObj_fstComplex(FSTObj fstObj,float *dataArr,int minIndex,int maxIndex,float *mComplexArr){
+
+	__fstObj_fst(fstObj,dataArr,minIndex,maxIndex,NULL,NULL,mComplexArr);
+}
+
+static void __fstObj_fst(FSTObj fstObj,float *dataArr,int minIndex,int maxIndex,
+						float *mRealArr,float *mImageArr,float *mComplexArr){
 	FFTObj fftObj=NULL;
 	FFTObj *fftObjArr=NULL; 
 
@@ -265,12 +280,25 @@ void fstObj_fst(FSTObj fstObj,float *dataArr,int minIndex,int maxIndex,float *mR
 	nLen=fftLength;
 	mLen=fftLength;
 	for(int i=fftLength/2-minIndex,k=0;i>=fftLength/2-maxIndex;i--,k++){
-		for(int j=0;j<mLen;j++){
-			int _index=0;
+		if(mComplexArr){ // interleaved
+			float *_complexArr=mComplexArr+2*(long long )k*mLen;
 
-			_index=mIndexArr[(long long )i*mLen+j];
-			mRealArr[(long long )k*mLen+j]=realArr1[_index];
-			mImageArr[(long long )k*mLen+j]=imageArr1[_index];
+			for(int j=0;j<mLen;j++){
+				int _index=0;
+
+				_index=mIndexArr[(long long )i*mLen+j];
+				_complexArr[2*j]=realArr1[_index];
+				_complexArr[2*j+1]=imageArr1[_index];
+			}
+		}
+		else{
+			for(int j=0;j<mLen;j++){
+				int _index=0;
+
+				_index=mIndexArr[(long long )i*mLen+j];
+				mRealArr[(long long )k*mLen+j]=realArr1[_index];
+				mImageArr[(long long )k*mLen+j]=imageArr1[_index];
+			}
 		}
 	}
 
@@ -16,6 +16,8 @@ typedef struct OpaqueFST *FSTObj;
 int fstObj_new(FSTObj *fstObj,int radix2Exp);
 
 void fstObj_fst(FSTObj fstObj,float *dataArr,int minIndex,int maxIndex,float *mRealArr,float *mImageArr);
+// mComplexArr interleaved real/image(complex64), (maxIndex-minIndex+1)*fftLength*2
+void fstObj_fstComplex(FSTObj fstObj,float *dataArr,int minIndex,int maxIndex,float *mComplexArr);
 
 void fstObj_free(FSTObj fstObj);
 